@@ -0,0 +1,65 @@
+import os
+import re
+import json
+import logging
+from typing import List
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# ---------- CONFIG ----------
+SKILLS_PATH = os.path.join(os.path.dirname(__file__), "skills.json")
+MAX_KEYWORDS = 40
+
+logger = logging.getLogger(__name__)
+
+def _load_skills() -> List[str]:
+    try:
+        with open(SKILLS_PATH, "r") as f:
+            return [s.lower() for s in json.load(f)]
+    except Exception:
+        logger.exception("Failed to load skills gazetteer from %s", SKILLS_PATH)
+        return []
+
+SKILLS = _load_skills()
+
+# ---------- EXTRACTION ----------
+def _contains_term(text: str, term: str) -> bool:
+    # Word boundaries that still treat "c++", "c#" and ".net" as whole terms
+    return re.search(rf"(?<![\w+#.-]){re.escape(term)}(?![\w+#])", text) is not None
+
+def find_skills(text: str) -> List[str]:
+    """Return gazetteer skills mentioned in the text."""
+    lowered = text.lower()
+    return [skill for skill in SKILLS if _contains_term(lowered, skill)]
+
+def tfidf_terms(text: str, max_features: int = 200) -> List[str]:
+    """Return the document's uni/bigrams ranked by TF-IDF weight."""
+    # Tokens start with a letter, so dates, phone numbers and ids are ignored
+    vec = TfidfVectorizer(
+        stop_words="english",
+        ngram_range=(1, 2),
+        max_features=max_features,
+        token_pattern=r"(?u)\b[a-zA-Z][a-zA-Z+#]+\b",
+    )
+    try:
+        matrix = vec.fit_transform([text])
+    except ValueError:
+        # Empty vocabulary (e.g. text made only of stop words)
+        return []
+    weights = matrix.toarray()[0]
+    terms = vec.get_feature_names_out()
+    ranked = sorted(zip(weights, terms), key=lambda wt: (-wt[0], wt[1]))
+    return [term for _, term in ranked]
+
+def extract_keywords(text: str, limit: int = MAX_KEYWORDS) -> List[str]:
+    """
+    Keywords for a resume: known skills first, then the highest-weighted
+    TF-IDF terms, without duplicates.
+    """
+    keywords: List[str] = []
+    for term in find_skills(text) + tfidf_terms(text):
+        if term not in keywords:
+            keywords.append(term)
+        if len(keywords) >= limit:
+            break
+    return keywords
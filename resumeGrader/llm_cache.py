@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import List, Optional
+
+# ---------- CONFIG ----------
+CACHE_DIR = os.path.join(os.path.dirname(__file__), ".cache")
+TTL_SECONDS = 24 * 60 * 60
+MAX_CACHE_BYTES = 500 * 1024 * 1024
+# Eviction stats every entry, so it runs on the first write and then every EVICT_EVERY writes
+EVICT_EVERY = 100
+
+_writes = 0
+
+logger = logging.getLogger(__name__)
+
+# ---------- KEYS ----------
+def cache_key(model: str, messages: List[dict], temperature: float) -> Optional[str]:
+    """
+    SHA-256 of the normalized request. Returns None for sampled (temperature > 0)
+    requests, whose output is not deterministic and therefore not cached.
+    """
+    if temperature > 0:
+        return None
+    h = hashlib.sha256()
+    h.update(f"{model}\0{temperature}\0".encode("utf-8"))
+    # Hash message by message rather than building one large payload string
+    for message in messages:
+        normalized = dict(message)
+        if isinstance(normalized.get("content"), str):
+            normalized["content"] = normalized["content"].strip()
+        h.update(json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def _path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+# ---------- STORAGE ----------
+def get(key: str) -> Optional[str]:
+    """Return the cached completion for key, or None if missing or expired."""
+    path = _path(key)
+    try:
+        with open(path, "r") as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.exception("Failed to read cache entry %s", key)
+        return None
+
+    if time.time() - entry.get("created", 0) > TTL_SECONDS:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    # Bump mtime so eviction drops least recently used entries first
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    return entry.get("content")
+
+def put(key: str, content: str) -> None:
+    """Store a completion under key, periodically evicting old entries in the background."""
+    global _writes
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _path(key)
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump({"created": time.time(), "content": content}, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        logger.exception("Failed to write cache entry %s", key)
+        return
+    if _writes % EVICT_EVERY == 0:
+        # Callers are async handlers; keep the directory scan off the event loop
+        threading.Thread(target=_evict, name="llm-cache-evict", daemon=True).start()
+    _writes += 1
+
+def _evict() -> None:
+    """Remove least recently used entries until the cache fits in MAX_CACHE_BYTES."""
+    entries = []
+    total = 0
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+
+    if total <= MAX_CACHE_BYTES:
+        return
+    entries.sort()
+    for _, size, path in entries:
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if total <= MAX_CACHE_BYTES:
+            break
@@ -1,10 +1,16 @@
 import os
 import re
+import asyncio
 import json
+import time
+import hashlib
 import tempfile
 import logging
+import functools
+import contextlib
+import ipaddress
 from dotenv import load_dotenv
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message, Update
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -12,20 +18,77 @@ from telegram.ext import (
     ContextTypes,
     filters,
     CallbackQueryHandler,
+    PicklePersistence,
 )
 from telegram.constants import ParseMode
-import requests
-from bs4 import BeautifulSoup
-import PyPDF2
+from telegram.helpers import escape_markdown
+import httpx
+from selectolax.lexbor import LexborHTMLParser
+import pypdfium2 as pdfium
 import openai
+from openai import AsyncOpenAI
+from aiolimiter import AsyncLimiter
+from tenacity import (
+    before_sleep_log,
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 import numpy as np
-from typing import List, Tuple
+import tiktoken
+from typing import List, Optional, Tuple
+
+import keywords
+import llm_cache
+import summary_batch
 
 # ---------- CONFIG ----------
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai.api_key = OPENAI_API_KEY
+# Pooled HTTP/2 connections, created once and reused by every handler
+openai_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+    timeout=httpx.Timeout(60.0, connect=10.0),
+)
+# Redirects are followed by hand so every hop goes through _is_public_host
+web_http_client = httpx.AsyncClient(
+    http2=True,
+    headers={"User-Agent": "Mozilla/5.0 (compatible; ResumeScoreBot/1.0)"},
+    timeout=10,
+)
+# main() refuses to start without a key, so the client is only None at import time.
+# SDK retries are disabled: openai_retry below is the single retry layer.
+client = (
+    AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=openai_http_client, max_retries=0)
+    if OPENAI_API_KEY
+    else None
+)
+# Caps concurrent OpenAI request attempts and open streams (taken inside the retry loop, see openai_retry)
+OPENAI_CONCURRENCY = asyncio.Semaphore(20)
+# Requests-per-minute budget shared by all handlers (token bucket)
+OPENAI_RATE_LIMIT = AsyncLimiter(max_rate=3000, time_period=60)
+# When set, tailored summaries are queued for the OpenAI Batch API (50% cheaper, up to 24h)
+USE_BATCH = os.getenv("BATCH_MODE", "").strip().lower() in ("1", "true", "yes", "on")
+# Minimum seconds between edits of a streamed reply (Telegram rate-limits edits per chat)
+STREAM_EDIT_INTERVAL = 1.0
+
+# Resumes longer than this are condensed once at upload instead of being truncated
+RESUME_TOKEN_BUDGET = 1500
+# Rough English average, used when the tokenizer is unavailable
+CHARS_PER_TOKEN = 4
+
+# user_data (parsed resume, last job description) survives restarts
+STATE_PATH = os.path.join(os.path.dirname(__file__), ".state", "bot.pkl")
+
+# Extracted job descriptions, keyed by URL hash
+JD_CACHE_DIR = os.path.join(os.path.dirname(__file__), ".cache", "jd")
+JD_CACHE_TTL = 60 * 60
+# Job posting pages larger than this are not downloaded
+MAX_JD_BYTES = 2 * 1024 * 1024
+MAX_JD_REDIRECTS = 5
 
 # ---------- RAG / KB STORAGE ----------
 KB_PATH = os.path.join(os.path.dirname(__file__), "kb_store.json")
@@ -57,29 +120,29 @@ def _chunk_text(text: str, chunk_size: int = 1200, overlap: int = 150) -> List[s
             start = 0
     return chunks
 
-def _embed_texts(texts: List[str]) -> List[List[float]]:
+async def _embed_texts(texts: List[str]) -> List[List[float]]:
     if not texts:
         return []
-    resp = openai.Embedding.create(model="text-embedding-3-small", input=texts)
-    vectors = [d["embedding"] for d in resp["data"]]
+    resp = await create_embeddings(model="text-embedding-3-small", input=texts)
+    vectors = [d.embedding for d in resp.data]
     return vectors
 
-def add_document_to_kb(text: str, source: str) -> Tuple[int, int]:
+async def add_document_to_kb(text: str, source: str) -> Tuple[int, int]:
     """Add a document to KB. Returns (num_chunks, total_vectors)."""
     kb = _load_kb()
     chunks = _chunk_text(text)
-    vectors = _embed_texts(chunks)
+    vectors = await _embed_texts(chunks)
     kb["chunks"].extend(chunks)
     kb["vectors"].extend(vectors)
     kb["sources"].extend([source] * len(chunks))
     _save_kb(kb)
     return len(chunks), len(kb["vectors"])
 
-def retrieve_chunks(query: str, top_k: int = 5) -> List[str]:
+async def retrieve_chunks(query: str, top_k: int = 5) -> List[str]:
     kb = _load_kb()
     if not kb["vectors"]:
         return []
-    q_vec = _embed_texts([query])[0]
+    q_vec = (await _embed_texts([query]))[0]
     vecs = np.array(kb["vectors"], dtype=np.float32)
     q = np.array(q_vec, dtype=np.float32)
     # cosine similarity
@@ -89,56 +152,264 @@ def retrieve_chunks(query: str, top_k: int = 5) -> List[str]:
     idxs = sims.argsort()[-top_k:][::-1]
     return [kb["chunks"][int(i)] for i in idxs]
 
+# ---------- PROMPTS ----------
+# The resume block is built once per upload and sent first on every call, so all
+# actions share a byte-identical prefix that OpenAI's prompt caching can reuse.
+RESUME_STATIC_WRAPPER = """You are assisting a candidate with their job application.
+The candidate's resume is below. Follow the task instructions in the next message.
+
+Resume:
+"""
+
+COMPRESS_PROMPT = """Condense the resume below into a compact, structured version for automated job matching.
+Keep every section (summary, experience, projects, education, skills, achievements) with roles,
+companies, dates, technologies, metrics and concrete results. Drop contact details, addresses,
+references and filler wording. Use terse bullet points. Return only the condensed resume.
+
+Resume:
+"""
+
+# Resume keywords are extracted locally at upload (see keywords.py) and shown by
+# the bot, so the model only compares and scores.
+ATS_PROMPT = """You are an ATS (Applicant Tracking System) assistant.
+Compare the resume to the job description. The resume keywords were already
+extracted and are listed with the resume; use them, do not list them again.
+
+Your response must always follow this structured format with emojis:
+
+*❌ Missing Keywords from Resume:*
+- list missing keywords clearly OR say: ✅ No missing keywords 🎉
+
+*📊 ATS Score (out of 100):*
+- Final score here, with 1–2 sentences of explanation."""
+
+MISSING_PROMPT = """You are a helpful recruiter assistant. Extract the most important keywords and competencies from the job description, compare them with the resume and its pre-extracted keywords, and return a concise Markdown-only response with emojis.
+
+Follow this exact structure:
+
+*❌ Missing Keywords (prioritized):*
+- keyword – very short why it's important (if applicable)
+- keyword – ...
+
+*✅ Matched Keywords:*
+- keyword, keyword, keyword
+
+*🧭 Suggestions to Improve:*
+- short actionable suggestion 1
+- short actionable suggestion 2
+- short actionable suggestion 3
+
+If there are no missing keywords, write: ✅ No missing keywords 🎉
+Keep it brief and skimmable. Return only Markdown."""
+
+SUMMARY_PROMPT = """Rewrite a concise, professional resume summary tailored to the job description. Use a confident, friendly tone. Return only Markdown, following this structure:
+
+*✍️ Tailored Professional Summary:*
+A 3–5 line paragraph highlighting the most relevant experience, skills, and impact for this role. Prefer bold for key role/skills, and keep it scannable."""
+
+# Missing skills + summary in one completion, so the resume and job description are read once
+ANALYSIS_SPLIT = "---SPLIT---"
+FULL_ANALYSIS_PROMPT = f"""Complete both tasks below for the same resume and job description.
+
+Task 1:
+{MISSING_PROMPT}
+
+Task 2:
+{SUMMARY_PROMPT}
+
+Return two sections separated by the line '{ANALYSIS_SPLIT}': first the missing-keywords Markdown, then the tailored summary."""
+
 # ---------- LOGGING ----------
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
+# ---------- OPENAI REQUESTS ----------
+def _is_transient_openai_error(exc: BaseException) -> bool:
+    """429s (except an exhausted quota), timeouts, dropped connections and 5xx."""
+    if isinstance(exc, openai.RateLimitError):
+        return exc.code != "insufficient_quota"
+    return isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError))
+
+# Transient failures are retried with jittered exponential backoff before the
+# handler shows an error to the user. The concurrency slot is taken per attempt,
+# so requests waiting out a backoff don't hold it.
+openai_retry = retry(
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception(_is_transient_openai_error),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True,
+)
+
+@openai_retry
+async def create_chat_completion(**kwargs):
+    async with OPENAI_CONCURRENCY, OPENAI_RATE_LIMIT:
+        return await client.chat.completions.create(**kwargs)
+
+@openai_retry
+async def _open_chat_stream(**kwargs):
+    await OPENAI_CONCURRENCY.acquire()
+    try:
+        async with OPENAI_RATE_LIMIT:
+            return await client.chat.completions.create(stream=True, **kwargs)
+    except BaseException:
+        OPENAI_CONCURRENCY.release()
+        raise
+
+@contextlib.asynccontextmanager
+async def stream_chat_completion(**kwargs):
+    """
+    Streamed chat completion. create() returns once the headers arrive, so the
+    concurrency slot is held until the body has been read or the stream is closed.
+    """
+    stream = await _open_chat_stream(**kwargs)
+    try:
+        yield stream
+    finally:
+        try:
+            await stream.close()
+        finally:
+            OPENAI_CONCURRENCY.release()
+
+@openai_retry
+async def create_embeddings(**kwargs):
+    async with OPENAI_CONCURRENCY, OPENAI_RATE_LIMIT:
+        return await client.embeddings.create(**kwargs)
+
 # ---------- HELPERS ----------
 def extract_text_from_pdf(path: str) -> str:
-    """Extract text from a PDF using PyPDF2 (simple, works for many PDFs)."""
+    """Extract text from a PDF using pypdfium2 (native PDFium bindings, fast on multi-page files)."""
     text = []
     try:
-        with open(path, "rb") as f:
-            reader = PyPDF2.PdfReader(f)
-            for page in reader.pages:
-                page_text = page.extract_text()
+        pdf = pdfium.PdfDocument(path)
+        try:
+            for page in pdf:
+                page_text = page.get_textpage().get_text_range()
                 if page_text:
-                    text.append(page_text)
+                    text.append(page_text.replace("\r\n", "\n"))
+        finally:
+            pdf.close()
     except Exception as e:
         logger.exception("Failed to extract PDF text: %s", e)
     return "\n".join(text).strip()
 
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_parsed_resume(pdf_hash: str) -> dict:
+    """Previously extracted data for an identical PDF upload (empty dict if none)."""
+    cached = llm_cache.get(f"resume-{pdf_hash}")
+    return json.loads(cached) if cached else {}
+
+def save_parsed_resume(pdf_hash: str, parsed: dict) -> None:
+    llm_cache.put(f"resume-{pdf_hash}", json.dumps(parsed))
+
 def is_url(text: str) -> bool:
     return bool(re.match(r"https?://", text.strip()))
 
-def fetch_job_description_from_url(url: str) -> str:
-    """Fetch the page and try to extract main text from <article> or <p> tags."""
-    try:
-        headers = {"User-Agent": "Mozilla/5.0 (compatible; ResumeScoreBot/1.0)"}
-        resp = requests.get(url, headers=headers, timeout=10)
-        resp.raise_for_status()
-        soup = BeautifulSoup(resp.text, "html.parser")
-
-        # Try common article containers first
-        article = soup.find("article")
-        if article:
-            paragraphs = [p.get_text(separator=" ", strip=True) for p in article.find_all("p")]
-            if paragraphs:
-                return "\n\n".join(paragraphs)
-
-        # Fallback: collect visible <p> text
-        paragraphs = [p.get_text(separator=" ", strip=True) for p in soup.find_all("p")]
+def _extract_job_description(html: str) -> str:
+    """Extract main text from <article> or <p> tags."""
+    tree = LexborHTMLParser(html)
+
+    # Try common article containers first
+    article = tree.css_first("article")
+    if article:
+        paragraphs = [p.text(separator=" ", strip=True) for p in article.css("p")]
+        paragraphs = [p for p in paragraphs if p]
         if paragraphs:
             return "\n\n".join(paragraphs)
 
-        # As a last resort, return raw text
-        return soup.get_text(separator="\n", strip=True)
+    # Fallback: collect visible <p> text
+    paragraphs = [p.text(separator=" ", strip=True) for p in tree.css("p")]
+    paragraphs = [p for p in paragraphs if p]
+    if paragraphs:
+        return "\n\n".join(paragraphs)
+
+    # As a last resort, return raw text
+    root = tree.body or tree.root
+    return root.text(separator="\n", strip=True) if root else ""
+
+async def _is_public_host(host: str) -> bool:
+    """True if every address the host resolves to is publicly routable."""
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, None)
+    except OSError:
+        return False
+    for info in infos:
+        ip = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            return False
+    return bool(infos)
+
+async def _download_page(url: str) -> str:
+    """
+    GET the page, following up to MAX_JD_REDIRECTS redirects. Refuses private,
+    loopback and other non-public hosts and bodies larger than MAX_JD_BYTES.
+    """
+    request = web_http_client.build_request("GET", url)
+    for _ in range(MAX_JD_REDIRECTS + 1):
+        if not await _is_public_host(request.url.host):
+            raise ValueError(f"Refusing to fetch non-public host {request.url.host!r}")
+        resp = await web_http_client.send(request, stream=True)
+        try:
+            if resp.next_request is not None:
+                request = resp.next_request
+                continue
+            resp.raise_for_status()
+            body = bytearray()
+            async for chunk in resp.aiter_bytes():
+                body.extend(chunk)
+                if len(body) > MAX_JD_BYTES:
+                    raise ValueError(f"Job posting is larger than {MAX_JD_BYTES} bytes")
+            return body.decode(resp.encoding or "utf-8", errors="replace")
+        finally:
+            await resp.aclose()
+    raise ValueError(f"More than {MAX_JD_REDIRECTS} redirects")
+
+def _prune_jd_cache() -> None:
+    """Delete expired job descriptions so the cache doesn't grow without bound."""
+    now = time.time()
+    for name in os.listdir(JD_CACHE_DIR):
+        path = os.path.join(JD_CACHE_DIR, name)
+        try:
+            if now - os.path.getmtime(path) >= JD_CACHE_TTL:
+                os.remove(path)
+        except OSError:
+            continue
+
+async def fetch_job_description_from_url(url: str) -> str:
+    """Fetch the page and extract the job description, reusing recent results for the same URL."""
+    cache_path = os.path.join(JD_CACHE_DIR, f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.txt")
+    try:
+        if time.time() - os.path.getmtime(cache_path) < JD_CACHE_TTL:
+            with open(cache_path, "r") as f:
+                return f.read()
+    except OSError:
+        pass
+
+    try:
+        html = await _download_page(url)
+        job_desc = _extract_job_description(html)
     except Exception as e:
         logger.exception("Failed to fetch job description from URL: %s", e)
         return ""
 
+    if job_desc:
+        try:
+            os.makedirs(JD_CACHE_DIR, exist_ok=True)
+            await asyncio.to_thread(_prune_jd_cache)
+            with open(cache_path, "w") as f:
+                f.write(job_desc)
+        except OSError as e:
+            logger.warning("Failed to cache job description: %s", e)
+    return job_desc
+
 def make_prompt_for_ats(resume_text: str, job_desc: str) -> str:
     """
     Create a strict instruction prompt asking the model to return JSON:
@@ -171,38 +442,242 @@ Job description:
 """
     return prompt
 
-def call_openai_chat(prompt: str) -> str:
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    try:
+        return tiktoken.encoding_for_model("gpt-4o-mini")
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text: str) -> int:
+    return len(_encoding().encode(text))
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    tokens = _encoding().encode(text)
+    return text if len(tokens) <= max_tokens else _encoding().decode(tokens[:max_tokens])
+
+def _truncate_resume(resume_text: str) -> str:
+    try:
+        return truncate_tokens(resume_text, RESUME_TOKEN_BUDGET)
+    except Exception as e:
+        logger.warning("Tokenizer unavailable, truncating by characters: %s", e)
+        return resume_text[:RESUME_TOKEN_BUDGET * CHARS_PER_TOKEN]
+
+async def compress_resume(resume_text: str) -> Tuple[str, bool]:
     """
-    Use OpenAI chat completion. Returns the assistant text (expected JSON).
+    Fit the resume into RESUME_TOKEN_BUDGET: short resumes are used as-is, longer
+    ones are condensed section by section with one model call. Returns the text and
+    whether it is worth caching (False when it is only a truncation fallback).
     """
+    # The first tiktoken call loads the BPE file (a download on first use), so keep
+    # tokenizing off the event loop and estimate from the length if it fails
+    try:
+        fits = await asyncio.to_thread(count_tokens, resume_text) <= RESUME_TOKEN_BUDGET
+    except Exception as e:
+        logger.warning("Tokenizer unavailable, estimating resume length: %s", e)
+        fits = len(resume_text) <= RESUME_TOKEN_BUDGET * CHARS_PER_TOKEN
+    if fits:
+        return resume_text, True
     try:
-        # Using chat completion as a generic call.
-        # If your OpenAI client differs, replace this with your SDK's call.
-        response = openai.ChatCompletion.create(
+        compact = await cached_chat(
+            [{"role": "user", "content": COMPRESS_PROMPT + resume_text}],
+            temperature=0.0,
+            max_tokens=RESUME_TOKEN_BUDGET,
+            action="compress",
+        )
+    except Exception as e:
+        logger.exception("Resume compression failed, truncating instead: %s", e)
+        compact = ""
+    if compact:
+        return compact, True
+    return await asyncio.to_thread(_truncate_resume, resume_text), False
+
+def build_resume_block(resume_compact: str, resume_keywords: List[str]) -> str:
+    return (
+        RESUME_STATIC_WRAPPER
+        + resume_compact
+        + "\n\nResume keywords (pre-extracted):\n"
+        + ", ".join(resume_keywords)
+    )
+
+def format_resume_keywords(resume_keywords: List[str]) -> str:
+    if not resume_keywords:
+        return ""
+    return "*📄 Resume Keywords:*\n" + escape_markdown(", ".join(resume_keywords)) + "\n\n"
+
+def format_job_desc(job_desc: str, kb_context: str = "") -> str:
+    content = f"Job Description:\n{job_desc}"
+    if kb_context:
+        content += f"\n\nExtra context from similar resumes (may help identify relevant skills):\n{kb_context}"
+    return content
+
+def build_messages(action_prompt: str, resume_block: str, job_content: str) -> List[dict]:
+    """
+    Build chat messages as [resume block, action instructions + job description].
+    The resume block is the stable, cacheable prefix; only the user turn varies.
+    """
+    return [
+        {"role": "system", "content": resume_block},
+        {"role": "user", "content": f"{action_prompt}\n\n{job_content}"},
+    ]
+
+def log_prompt_cache_usage(response, action: str) -> None:
+    """Log how many prompt tokens were served from OpenAI's prompt cache."""
+    usage = response.usage
+    if usage is None:
+        return
+    details = usage.prompt_tokens_details
+    logger.info(
+        "OpenAI %s: prompt_tokens=%s cached_tokens=%s",
+        action,
+        usage.prompt_tokens,
+        (details.cached_tokens if details else 0) or 0,
+    )
+
+async def cached_chat(
+    messages: List[dict],
+    temperature: float,
+    max_tokens: int,
+    action: str,
+    model: str = "gpt-4o-mini",
+) -> str:
+    """
+    Chat completion with a local on-disk cache for deterministic (temperature 0)
+    requests. Returns the assistant text.
+    """
+    key = llm_cache.cache_key(model, messages, temperature)
+    if key:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            logger.info("OpenAI %s: served from local cache", action)
+            return cached
+
+    response = await create_chat_completion(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+    log_prompt_cache_usage(response, action)
+    result = (response.choices[0].message.content or "").strip()
+    if not result:
+        raise RuntimeError(f"OpenAI {action}: empty completion")
+    if key:
+        llm_cache.put(key, result)
+    return result
+
+async def stream_chat(
+    messages: List[dict],
+    temperature: float,
+    max_tokens: int,
+    action: str,
+    message: Message,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    header: str = "",
+    model: str = "gpt-4o-mini",
+) -> str:
+    """
+    Like cached_chat, but streams the completion into an existing Telegram message,
+    editing it at most once per STREAM_EDIT_INTERVAL. The final edit is sent as
+    Markdown together with reply_markup, falling back to plain text if Telegram
+    rejects the formatting; header is shown above the reply but not cached.
+    Only replies that render as Markdown are cached. Returns the assistant text.
+    """
+    key = llm_cache.cache_key(model, messages, temperature)
+    cached = llm_cache.get(key) if key else None
+    if cached is not None:
+        logger.info("OpenAI %s: served from local cache", action)
+        result = cached
+    else:
+        parts: List[str] = []
+        last_edit = time.monotonic()
+        async with stream_chat_completion(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream_options={"include_usage": True},
+        ) as stream:
+            async for chunk in stream:
+                if chunk.usage:
+                    log_prompt_cache_usage(chunk, action)
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                parts.append(chunk.choices[0].delta.content)
+                if time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                    last_edit = time.monotonic()
+                    # Partial output may have unbalanced Markdown, so intermediate edits are plain text
+                    try:
+                        await message.edit_text(header + "".join(parts) + " …")
+                    except Exception as e:
+                        logger.debug("Skipped streaming edit: %s", e)
+        result = "".join(parts).strip()
+        if not result:
+            raise RuntimeError(f"OpenAI {action}: empty completion")
+
+    try:
+        await message.edit_text(header + result, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+    except Exception as e:
+        logger.warning("Markdown edit for %s failed, retrying as plain text: %s", action, e)
+        await message.edit_text(header + result, reply_markup=reply_markup)
+        return result
+    if key and cached is None:
+        llm_cache.put(key, result)
+    return result
+
+async def run_ats(
+    action_prompt: str,
+    resume_block: str,
+    job_content: str,
+    temperature: float,
+    max_tokens: int,
+    action: str,
+    stream_to: Optional[Message] = None,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    header: str = "",
+) -> str:
+    """Run one action against the resume. With stream_to, the reply is streamed into that message."""
+    messages = build_messages(action_prompt, resume_block, job_content)
+    if stream_to is not None:
+        return await stream_chat(
+            messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            action=action,
+            message=stream_to,
+            reply_markup=reply_markup,
+            header=header,
+        )
+    return await cached_chat(messages, temperature=temperature, max_tokens=max_tokens, action=action)
+
+async def call_openai_chat(prompt: str, response_format: Optional[dict] = None) -> str:
+    """
+    Use OpenAI chat completion in JSON mode. Returns the assistant text (a JSON object).
+    Pass a json_schema response_format to enforce a specific schema.
+    Note: nothing calls the JSON helpers yet; the bot's actions reply in Markdown.
+    """
+    try:
+        response = await create_chat_completion(
             model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
+            messages=[
+                {"role": "system", "content": "Output strictly JSON matching the schema."},
+                {"role": "user", "content": prompt},
+            ],
             temperature=0.0,
             max_tokens=1000,
+            response_format=response_format or {"type": "json_object"},
         )
         # The returned text:
-        return response["choices"][0]["message"]["content"].strip()
+        return response.choices[0].message.content.strip()
     except Exception as e:
         logger.exception("OpenAI request failed: %s", e)
         raise
 
 def parse_model_json(output_text: str) -> dict:
     """
-    Try to find a JSON object in the model output and parse it.
+    Parse the model output. JSON mode guarantees a JSON object, so no scanning is needed.
     """
-    # Try to locate the first JSON object {...}
     try:
-        # Find the first '{' and last '}' to try extract JSON blob
-        start = output_text.find("{")
-        end = output_text.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            json_text = output_text[start:end+1]
-            return json.loads(json_text)
-        # Fallback attempt: try direct json loads
         return json.loads(output_text)
     except Exception as e:
         logger.exception("Failed to parse JSON from model output: %s", e)
@@ -216,6 +691,25 @@ def parse_model_json(output_text: str) -> dict:
         }
 
 # ---------- TELEGRAM HANDLERS ----------
+# Strong references so background tasks aren't garbage-collected
+_background_tasks = set()
+
+NEXT_ACTIONS_MARKUP = InlineKeyboardMarkup(
+    [
+        [
+            InlineKeyboardButton("🔄 Re-run check", callback_data="rerun"),
+            InlineKeyboardButton("❌ Missing skills", callback_data="missing"),
+        ],
+        [
+            InlineKeyboardButton("✍️ Tailored summary", callback_data="summary"),
+            InlineKeyboardButton("🆕 New Job", callback_data="new_job"),
+        ],
+        [
+            InlineKeyboardButton("🧾 Full analysis", callback_data="missing_and_summary"),
+        ],
+    ]
+)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "Hello! I'm ResumeScoreBot 🤖\n\n"
@@ -245,14 +739,23 @@ async def handle_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
         tg_file = await doc.get_file()   # <-- await here
         await tg_file.download_to_drive(file_path)
 
-        resume_text = extract_text_from_pdf(file_path)
+        # Identical re-uploads reuse the earlier extraction
+        pdf_hash = await asyncio.to_thread(file_sha256, file_path)
+        parsed = load_parsed_resume(pdf_hash)
+        resume_text = parsed.get("text")
+        if not resume_text:
+            # Parsing is synchronous; run it off the event loop so other updates keep flowing
+            resume_text = await asyncio.to_thread(extract_text_from_pdf, file_path)
+            if resume_text:
+                parsed = {"text": resume_text}
+                save_parsed_resume(pdf_hash, parsed)
         if not resume_text:
             await update.message.reply_text("⚠️ *Could not extract text from the PDF.* Try a different file.", parse_mode=ParseMode.MARKDOWN)
             return
 
         # If user is in KB add mode, add to knowledge base instead of treating as main resume
         if context.user_data.get("kb_mode"):
-            num_chunks, total = add_document_to_kb(resume_text, source=doc.file_name)
+            num_chunks, total = await add_document_to_kb(resume_text, source=doc.file_name)
             await update.message.reply_text(
                 f"🧠 *Added to knowledge base:* `{doc.file_name}`\n"
                 f"Chunks: {num_chunks} • Total KB vectors: {total}",
@@ -260,7 +763,23 @@ async def handle_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
+        resume_keywords = parsed.get("keywords")
+        if resume_keywords is None:
+            resume_keywords = await asyncio.to_thread(keywords.extract_keywords, resume_text)
+            parsed["keywords"] = resume_keywords
+            save_parsed_resume(pdf_hash, parsed)
+        resume_compact = parsed.get("compact")
+        if resume_compact is None:
+            resume_compact, cacheable = await compress_resume(resume_text)
+            # A truncation fallback is retried on the next upload instead of being kept
+            if cacheable:
+                parsed["compact"] = resume_compact
+                save_parsed_resume(pdf_hash, parsed)
+        context.user_data["resume_hash"] = pdf_hash
         context.user_data["resume_text"] = resume_text
+        context.user_data["resume_keywords"] = resume_keywords
+        context.user_data["resume_compact"] = resume_compact
+        context.user_data["resume_block"] = build_resume_block(resume_compact, resume_keywords)
         context.user_data["resume_file_path"] = file_path
 
         await update.message.reply_text(
@@ -278,77 +797,72 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_message = update.message.text.strip()
 
     # If the user didn’t upload a resume yet
-    if "resume_text" not in context.user_data:
+    if "resume_block" not in context.user_data:
         await update.message.reply_text("⚠️ *Please upload your resume PDF first.* 📄", parse_mode=ParseMode.MARKDOWN)
         return
 
-    resume_text = context.user_data["resume_text"]
+    resume_block = context.user_data["resume_block"]
+
+    # Job posting links are fetched and reduced to their text
+    if is_url(user_message):
+        user_message = await fetch_job_description_from_url(user_message)
+        if not user_message:
+            await update.message.reply_text(
+                "⚠️ *Could not read the job posting from that link.* Please paste the description text instead.",
+                parse_mode=ParseMode.MARKDOWN,
+            )
+            return
 
     # 🆕 Save job description so buttons can reuse it
     context.user_data["last_job_desc"] = user_message
+    context.user_data["precomputed"] = {}
 
     # Retrieve relevant context from KB (RAG)
-    kb_context_chunks = retrieve_chunks(user_message, top_k=5)
+    kb_context_chunks = await retrieve_chunks(user_message, top_k=5)
     kb_context = "\n\n".join(kb_context_chunks) if kb_context_chunks else ""
 
     # Use OpenAI to score the resume vs job description, augmented with KB context
-    prompt = f"""
-    You are an ATS (Applicant Tracking System) assistant.
-    Compare the following resume to the job description.
-
-    Your response must always follow this structured format with emojis:
-
-    *📌 Job Description Keywords:*
-    - keyword1
-    - keyword2
-
-    *📄 Resume Keywords:*
-    - 🎓 **Education**: ...
-    - 🛠️ **Technical Skills**: ...
-    - 💡 **Projects**: ...
-    - 🏆 **Achievements**: ...
-
-    *❌ Missing Keywords from Resume:*
-    - list missing keywords clearly OR say: ✅ No missing keywords 🎉
+    job_content = format_job_desc(user_message, kb_context)
 
-    *📊 ATS Score (out of 100):*
-    - Final score here, with 1–2 sentences of explanation.
-
-    Resume:
-    {resume_text[:3000]}
-
-    Job Description:
-    {user_message}
-
-    Extra context from similar resumes (may help identify relevant skills):
-    {kb_context}
-    """
+    def store_precomputed(action: str, task: asyncio.Task) -> None:
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.warning("Precomputing %s failed: %s", action, task.exception())
+            return
+        # Ignore results that finish after the user moved on to another job description
+        if context.user_data.get("last_job_desc") == user_message:
+            context.user_data.setdefault("precomputed", {})[action] = task.result()
+
+    # Generate the button results alongside the score; each one is stored as soon
+    # as it finishes, and taps that arrive earlier fall back to an on-demand call
+    job_only = format_job_desc(user_message)
+    precompute = {
+        "missing": asyncio.create_task(
+            run_ats(MISSING_PROMPT, resume_block, job_only, temperature=0.0, max_tokens=600, action="missing")
+        ),
+    }
+    if not USE_BATCH:
+        precompute["summary"] = asyncio.create_task(
+            run_ats(SUMMARY_PROMPT, resume_block, job_only, temperature=0.3, max_tokens=600, action="summary")
+        )
+    for action, task in precompute.items():
+        task.add_done_callback(functools.partial(store_precomputed, action))
+        # Tasks outlive this handler; keep them referenced until done
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
 
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.0,
-            max_tokens=800,
+        reply = await update.message.reply_text("⏳ Checking your resume…")
+        await run_ats(
+            ATS_PROMPT, resume_block, job_content, temperature=0.0, max_tokens=800, action="ats",
+            stream_to=reply, header=format_resume_keywords(context.user_data.get("resume_keywords", [])),
         )
-        ats_result = response["choices"][0]["message"]["content"].strip()
-        await update.message.reply_text(ats_result, parse_mode=ParseMode.MARKDOWN)
-
-        # 🆕 Add inline buttons
-        keyboard = [
-            [
-                InlineKeyboardButton("🔄 Re-run check", callback_data="rerun"),
-                InlineKeyboardButton("❌ Missing skills", callback_data="missing"),
-            ],
-            [
-                InlineKeyboardButton("✍️ Tailored summary", callback_data="summary"),
-                InlineKeyboardButton("🆕 New Job", callback_data="new_job"),
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("✨ *What would you like to do next?*", reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+        await update.message.reply_text("✨ *What would you like to do next?*", reply_markup=NEXT_ACTIONS_MARKUP, parse_mode=ParseMode.MARKDOWN)
 
     except Exception as e:
+        for task in precompute.values():
+            task.cancel()
         await update.message.reply_text("⚠️ *Something went wrong while checking ATS score.*", parse_mode=ParseMode.MARKDOWN)
         print(f"OpenAI error: {e}")
 
@@ -357,164 +871,94 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()  # Acknowledge the button click
 
-    resume_text = context.user_data.get("resume_text")
+    resume_block = context.user_data.get("resume_block")
     last_job_desc = context.user_data.get("last_job_desc")
 
-    if not resume_text or not last_job_desc:
+    if not resume_block or not last_job_desc:
         await query.edit_message_text("Please upload a resume and job description first.")
         return
 
-    if query.data == "rerun":
-        await query.edit_message_text("🔄 *Re-running ATS check...*", parse_mode=ParseMode.MARKDOWN)
-        # Reuse the same structured prompt as in handle_text, with KB context
-        kb_context_chunks = retrieve_chunks(last_job_desc, top_k=5)
-        kb_context = "\n\n".join(kb_context_chunks) if kb_context_chunks else ""
-        prompt = f"""
-        You are an ATS (Applicant Tracking System) assistant.
-        Compare the following resume to the job description.
-
-        Your response must always follow this structured format with emojis:
-
-        *📌 Job Description Keywords:*
-        - keyword1
-        - keyword2
-
-        *📄 Resume Keywords:*
-        - 🎓 **Education**: ...
-        - 🛠️ **Technical Skills**: ...
-        - 💡 **Projects**: ...
-        - 🏆 **Achievements**: ...
+    precomputed = context.user_data.get("precomputed", {})
 
-        *❌ Missing Keywords from Resume:*
-        - list missing keywords clearly OR say: ✅ No missing keywords 🎉
-
-        *📊 ATS Score (out of 100):*
-        - Final score here, with 1–2 sentences of explanation.
-
-        Resume:
-        {resume_text[:3000]}
-
-        Job Description:
-        {last_job_desc}
+    try:
+        if query.data == "rerun":
+            await query.edit_message_text("🔄 *Re-running ATS check...*", parse_mode=ParseMode.MARKDOWN)
+            # Reuse the same structured prompt as in handle_text, with KB context
+            kb_context_chunks = await retrieve_chunks(last_job_desc, top_k=5)
+            kb_context = "\n\n".join(kb_context_chunks) if kb_context_chunks else ""
+            job_content = format_job_desc(last_job_desc, kb_context)
+            try:
+                await run_ats(
+                    ATS_PROMPT, resume_block, job_content, temperature=0.0, max_tokens=800, action="rerun",
+                    stream_to=query.message, header=format_resume_keywords(context.user_data.get("resume_keywords", [])),
+                )
+                await query.message.reply_text("✨ *What would you like to do next?*", reply_markup=NEXT_ACTIONS_MARKUP, parse_mode=ParseMode.MARKDOWN)
+            except Exception as e:
+                await query.edit_message_text("⚠️ *Something went wrong while re-running the ATS check.*", parse_mode=ParseMode.MARKDOWN)
+                logger.exception("OpenAI error on rerun: %s", e)
+
+        elif query.data == "missing" and "missing" in precomputed:
+            await query.edit_message_text(precomputed["missing"], parse_mode=ParseMode.MARKDOWN, reply_markup=NEXT_ACTIONS_MARKUP)
+
+        elif query.data == "missing":
+            await run_ats(
+                MISSING_PROMPT, resume_block, format_job_desc(last_job_desc), temperature=0.0, max_tokens=600,
+                action="missing", stream_to=query.message, reply_markup=NEXT_ACTIONS_MARKUP,
+            )
 
-        Extra context from similar resumes (may help identify relevant skills):
-        {kb_context}
-        """
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.0,
-                max_tokens=800,
+        elif query.data == "summary" and "summary" in precomputed:
+            await query.edit_message_text(precomputed["summary"], parse_mode=ParseMode.MARKDOWN, reply_markup=NEXT_ACTIONS_MARKUP)
+
+        elif query.data == "summary":
+            if USE_BATCH:
+                messages = build_messages(SUMMARY_PROMPT, resume_block, format_job_desc(last_job_desc))
+                summary_batch.enqueue(
+                    query.message.chat_id,
+                    {"model": "gpt-4o-mini", "messages": messages, "temperature": 0.3, "max_tokens": 600},
+                )
+                await query.edit_message_text(
+                    "🕒 *Tailored summary queued.* I'll send it here as soon as the batch finishes.",
+                    parse_mode=ParseMode.MARKDOWN,
+                    reply_markup=NEXT_ACTIONS_MARKUP,
+                )
+            else:
+                await run_ats(
+                    SUMMARY_PROMPT, resume_block, format_job_desc(last_job_desc), temperature=0.3, max_tokens=600,
+                    action="summary", stream_to=query.message, reply_markup=NEXT_ACTIONS_MARKUP,
+                )
+
+        elif query.data == "missing_and_summary" and "missing" in precomputed and "summary" in precomputed:
+            await query.edit_message_text(precomputed["missing"], parse_mode=ParseMode.MARKDOWN)
+            await query.message.reply_text(precomputed["summary"], parse_mode=ParseMode.MARKDOWN, reply_markup=NEXT_ACTIONS_MARKUP)
+
+        elif query.data == "missing_and_summary":
+            await query.edit_message_text("🧾 *Preparing full analysis...*", parse_mode=ParseMode.MARKDOWN)
+            result = await run_ats(
+                FULL_ANALYSIS_PROMPT, resume_block, format_job_desc(last_job_desc), temperature=0.0, max_tokens=1200,
+                action="missing_and_summary",
             )
-            ats_result = response["choices"][0]["message"]["content"].strip()
-            await query.edit_message_text(ats_result, parse_mode=ParseMode.MARKDOWN)
-
-            # Send buttons again for further actions
-            keyboard = [
-                [
-                    InlineKeyboardButton("🔄 Re-run check", callback_data="rerun"),
-                    InlineKeyboardButton("❌ Missing skills", callback_data="missing"),
-                ],
-                [
-                    InlineKeyboardButton("✍️ Tailored summary", callback_data="summary"),
-                    InlineKeyboardButton("🆕 New Job", callback_data="new_job"),
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text("✨ *What would you like to do next?*", reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
-        except Exception as e:
-            await query.edit_message_text("⚠️ *Something went wrong while re-running the ATS check.*", parse_mode=ParseMode.MARKDOWN)
-            logger.exception("OpenAI error on rerun: %s", e)
-
-    elif query.data == "missing":
-        prompt = f"""
-        You are a helpful recruiter assistant. Extract the most important keywords and competencies from the job description, compare with the resume, and return a concise Markdown-only response with emojis.
-
-        Follow this exact structure:
-
-        *❌ Missing Keywords (prioritized):*
-        - keyword – very short why it's important (if applicable)
-        - keyword – ...
-
-        *✅ Matched Keywords:*
-        - keyword, keyword, keyword
-
-        *🧭 Suggestions to Improve:*
-        - short actionable suggestion 1
-        - short actionable suggestion 2
-        - short actionable suggestion 3
-
-        If there are no missing keywords, write: ✅ No missing keywords 🎉
-        Keep it brief and skimmable. Return only Markdown.
-
-        Resume:
-        {resume_text[:3000]}
-
-        Job Description:
-        {last_job_desc}
-        """
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.0,
-            max_tokens=600,
-        )
-        result = response["choices"][0]["message"]["content"].strip()
-        keyboard = [
-            [
-                InlineKeyboardButton("🔄 Re-run check", callback_data="rerun"),
-                InlineKeyboardButton("❌ Missing skills", callback_data="missing"),
-            ],
-            [
-                InlineKeyboardButton("✍️ Tailored summary", callback_data="summary"),
-                InlineKeyboardButton("🆕 New Job", callback_data="new_job"),
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(result, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
-
-    elif query.data == "summary":
-        prompt = f"""
-        Rewrite a concise, professional resume summary tailored to the job description. Use a confident, friendly tone. Return only Markdown, following this structure:
-
-        *✍️ Tailored Professional Summary:*
-        A 3–5 line paragraph highlighting the most relevant experience, skills, and impact for this role. Prefer bold for key role/skills, and keep it scannable.
-
-        Resume:
-        {resume_text[:3000]}
-
-        Job Description:
-        {last_job_desc}
-        """
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-            max_tokens=600,
-        )
-        result = response["choices"][0]["message"]["content"].strip()
-        keyboard = [
-            [
-                InlineKeyboardButton("🔄 Re-run check", callback_data="rerun"),
-                InlineKeyboardButton("❌ Missing skills", callback_data="missing"),
-            ],
-            [
-                InlineKeyboardButton("✍️ Tailored summary", callback_data="summary"),
-                InlineKeyboardButton("🆕 New Job", callback_data="new_job"),
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(result, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
-
-    elif query.data == "new_job":
-        # Clear the last job description and prompt for a new one
-        context.user_data.pop("last_job_desc", None)
-        await query.edit_message_text(
-            "🆕 *Ready for a new job!*\n\n" 
-            "Send me the *job description* text or a *link* to the job posting.",
-            parse_mode=ParseMode.MARKDOWN
-        )
+            missing, _, summary = result.partition(ANALYSIS_SPLIT)
+            if missing.strip() and summary.strip():
+                await query.edit_message_text(missing.strip(), parse_mode=ParseMode.MARKDOWN)
+                await query.message.reply_text(summary.strip(), parse_mode=ParseMode.MARKDOWN, reply_markup=NEXT_ACTIONS_MARKUP)
+            else:
+                # Model ignored the separator or left one half empty; show the reply as a single message
+                single = (missing + summary).strip()
+                await query.edit_message_text(single, parse_mode=ParseMode.MARKDOWN, reply_markup=NEXT_ACTIONS_MARKUP)
+
+        elif query.data == "new_job":
+            # Clear the last job description and prompt for a new one
+            context.user_data.pop("last_job_desc", None)
+            context.user_data.pop("precomputed", None)
+            await query.edit_message_text(
+                "🆕 *Ready for a new job!*\n\n" 
+                "Send me the *job description* text or a *link* to the job posting.",
+                parse_mode=ParseMode.MARKDOWN
+            )
+
+    except Exception as e:
+        logger.exception("OpenAI error on %s: %s", query.data, e)
+        await query.message.reply_text("⚠️ *Something went wrong. Please try again.*", parse_mode=ParseMode.MARKDOWN)
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -555,13 +999,34 @@ async def done(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.MARKDOWN,
     )
 
+async def start_summary_batch_worker(app: Application) -> None:
+    task = asyncio.create_task(summary_batch.run(client, app.bot))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def close_http_clients(app: Application) -> None:
+    await openai_http_client.aclose()
+    await web_http_client.aclose()
+
 def main():
     if not BOT_TOKEN or not OPENAI_API_KEY:
         logger.error("BOT_TOKEN and OPENAI_API_KEY must be set in .env")
         print("BOT_TOKEN and OPENAI_API_KEY must be set in .env")
         return
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    persistence = PicklePersistence(filepath=STATE_PATH)
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .persistence(persistence)
+        # Handlers only await I/O, so let updates from different users run concurrently
+        .concurrent_updates(True)
+        .post_shutdown(close_http_clients)
+    )
+    if USE_BATCH:
+        builder = builder.post_init(start_summary_batch_worker)
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
@@ -575,7 +1040,13 @@ def main():
     app.add_handler(CallbackQueryHandler(button_handler))
 
     logger.info("Bot starting...")
-    app.run_polling()
+    # Long-poll for just the update types we handle
+    app.run_polling(
+        allowed_updates=[Update.MESSAGE, Update.CALLBACK_QUERY],
+        poll_interval=0.0,
+        timeout=30,
+        drop_pending_updates=True,
+    )
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,163 @@
+import os
+import json
+import uuid
+import asyncio
+import logging
+from typing import List
+
+from telegram.constants import ParseMode
+
+# ---------- CONFIG ----------
+BATCH_DIR = os.path.join(os.path.dirname(__file__), ".cache", "batch")
+PENDING_PATH = os.path.join(BATCH_DIR, "pending.jsonl")
+SUBMITTED_PATH = os.path.join(BATCH_DIR, "submitted.json")
+FLUSH_INTERVAL = 5 * 60
+POLL_INTERVAL = 60
+FAILED_MESSAGE = "⚠️ Your tailored summary could not be generated. Please tap ✍️ Tailored summary to try again."
+
+logger = logging.getLogger(__name__)
+
+# ---------- QUEUE ----------
+def enqueue(chat_id: int, body: dict) -> None:
+    """Append a chat completion request to the rolling batch input file."""
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    # custom_id must be unique within a batch; the chat id is recovered from its prefix
+    line = {
+        "custom_id": f"{chat_id}:{uuid.uuid4().hex[:8]}",
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": body,
+    }
+    with open(PENDING_PATH, "a") as f:
+        f.write(json.dumps(line) + "\n")
+
+def _load_submitted() -> List[str]:
+    if not os.path.exists(SUBMITTED_PATH):
+        return []
+    try:
+        with open(SUBMITTED_PATH, "r") as f:
+            return json.load(f)
+    except Exception:
+        return []
+
+def _save_submitted(batch_ids: List[str]) -> None:
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    with open(SUBMITTED_PATH, "w") as f:
+        json.dump(batch_ids, f)
+
+# ---------- OPENAI BATCH API ----------
+async def flush(client) -> None:
+    """Upload queued requests (if any) as a new 24h batch."""
+    if not os.path.exists(PENDING_PATH) or os.path.getsize(PENDING_PATH) == 0:
+        return
+    # Move the file aside so new requests go to a fresh queue while this one uploads
+    upload_path = os.path.join(BATCH_DIR, f"upload-{uuid.uuid4().hex}.jsonl")
+    os.replace(PENDING_PATH, upload_path)
+    try:
+        with open(upload_path, "rb") as f:
+            input_file = await client.files.create(file=f, purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+    except Exception as e:
+        logger.exception("Failed to submit summary batch: %s", e)
+        # Put the requests back so the next flush retries them
+        with open(upload_path, "r") as src, open(PENDING_PATH, "a") as dst:
+            dst.write(src.read())
+        os.remove(upload_path)
+        return
+    os.remove(upload_path)
+    _save_submitted(_load_submitted() + [batch.id])
+    logger.info("Submitted summary batch %s", batch.id)
+
+async def poll(client, bot) -> None:
+    """Check submitted batches and deliver results for the finished ones."""
+    remaining = []
+    for batch_id in _load_submitted():
+        try:
+            batch = await client.batches.retrieve(batch_id)
+            if batch.status in ("failed", "expired", "cancelled"):
+                logger.error("Summary batch %s ended with status %s", batch_id, batch.status)
+                # Results that did finish are still delivered; every other request is reported as failed
+                files = [batch.output_file_id, batch.error_file_id, batch.input_file_id]
+            elif batch.status == "completed":
+                files = [batch.output_file_id, batch.error_file_id, None]
+            else:
+                remaining.append(batch_id)
+                continue
+            # Download everything before sending, so a failed download can't cause a partial, repeated delivery
+            output, errors, inputs = [
+                (await client.files.content(file_id)).text if file_id else "" for file_id in files
+            ]
+        except Exception as e:
+            logger.exception("Failed to process batch %s: %s", batch_id, e)
+            remaining.append(batch_id)
+            continue
+
+        delivered = await _deliver(bot, output)
+        # Errored requests can appear in the output file, the error file, or (for a dead batch) only the input
+        failed = list(dict.fromkeys(
+            cid for cid in _custom_ids(output) + _custom_ids(errors) + _custom_ids(inputs) if cid not in delivered
+        ))
+        for custom_id in failed:
+            await _send(bot, _chat_id(custom_id), FAILED_MESSAGE)
+        logger.info("Finished summary batch %s: %d delivered, %d failed", batch_id, len(delivered), len(failed))
+    _save_submitted(remaining)
+
+def _chat_id(custom_id: str) -> int:
+    return int(custom_id.split(":", 1)[0])
+
+def _custom_ids(jsonl: str) -> List[str]:
+    ids = []
+    for line in jsonl.splitlines():
+        try:
+            ids.append(json.loads(line)["custom_id"])
+        except Exception:
+            continue
+    return ids
+
+async def _send(bot, chat_id: int, text: str) -> None:
+    """Send as Markdown, falling back to plain text if Telegram rejects the formatting."""
+    try:
+        await bot.send_message(chat_id, text, parse_mode=ParseMode.MARKDOWN)
+    except Exception as e:
+        logger.warning("Markdown send to %s failed, retrying as plain text: %s", chat_id, e)
+        try:
+            await bot.send_message(chat_id, text)
+        except Exception as e:
+            logger.exception("Failed to send batched summary to %s: %s", chat_id, e)
+
+async def _deliver(bot, output_jsonl: str) -> List[str]:
+    """Send successful results; returns their custom_ids. Errored lines are left for the caller."""
+    delivered = []
+    for line in output_jsonl.splitlines():
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                continue
+            text = response["body"]["choices"][0]["message"]["content"].strip()
+        except Exception as e:
+            logger.exception("Failed to read batched summary: %s", e)
+            continue
+        await _send(bot, _chat_id(item["custom_id"]), text)
+        delivered.append(item["custom_id"])
+    return delivered
+
+async def run(client, bot) -> None:
+    """Background loop: flush the queue every FLUSH_INTERVAL and poll in between."""
+    elapsed = 0
+    while True:
+        await asyncio.sleep(POLL_INTERVAL)
+        elapsed += POLL_INTERVAL
+        try:
+            if elapsed >= FLUSH_INTERVAL:
+                elapsed = 0
+                await flush(client)
+            await poll(client, bot)
+        except Exception as e:
+            logger.exception("Summary batch worker error: %s", e)